@@ -4,12 +4,21 @@ Web API for Audience Cleaner
 Handles large file uploads and processing via streaming to avoid memory issues
 """
 
+import time
+_startup_started = time.perf_counter()
+
 import os
 import csv
-import re
+import sys
 import tempfile
 import base64
-import hashlib
+import json
+import socket
+import ipaddress
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
 from pathlib import Path
 from flask import Flask, request, jsonify, send_file, send_from_directory
 
@@ -21,6 +30,8 @@ except ImportError:
     CORS_AVAILABLE = False
 from werkzeug.utils import secure_filename
 from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import MultipartDecoder, File, Field, Data, Epilogue, NeedData
 import uuid
 
 app = Flask(__name__, static_folder='static')
@@ -29,165 +40,74 @@ if CORS_AVAILABLE:
 app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024 * 1024  # 1GB max file size
 app.config['UPLOAD_FOLDER'] = tempfile.gettempdir()
 app.config['OUTPUT_FOLDER'] = tempfile.gettempdir()
+# Completion webhook delivery (see /upload callback_url)
+app.config['CALLBACK_MAX_ATTEMPTS'] = int(os.environ.get('CALLBACK_MAX_ATTEMPTS', 5))
+app.config['CALLBACK_BACKOFF_SECONDS'] = float(os.environ.get('CALLBACK_BACKOFF_SECONDS', 2))
+app.config['CALLBACK_TIMEOUT'] = float(os.environ.get('CALLBACK_TIMEOUT', 30))
+# Hosts callbacks may be sent to; when empty, any public (non-internal) address is allowed
+app.config['CALLBACK_ALLOWED_HOSTS'] = [h.strip().lower() for h in
+                                        os.environ.get('CALLBACK_ALLOWED_HOSTS', '').split(',') if h.strip()]
+# Background cleaning jobs per worker: running at once, and waiting before /upload returns 503
+app.config['CALLBACK_MAX_WORKERS'] = int(os.environ.get('CALLBACK_MAX_WORKERS', 2))
+app.config['CALLBACK_MAX_QUEUED'] = int(os.environ.get('CALLBACK_MAX_QUEUED', 4))
+# Memory budget for external merge sort (see /upload sort_by)
+app.config['SORT_MEMORY_BUDGET'] = int(float(os.environ.get('SORT_MEMORY_MB', 64)) * 1024 * 1024)
+if app.config['SORT_MEMORY_BUDGET'] <= 0:
+    raise ValueError("SORT_MEMORY_MB must be greater than zero")
+# Memory an in-memory reference index may use before the join spills to disk
+app.config['REFERENCE_INDEX_MAX_BYTES'] = int(float(os.environ.get('REFERENCE_INDEX_MB', 16)) * 1024 * 1024)
+# /preview reads at most this much of an upload
+app.config['PREVIEW_MAX_BYTES'] = 4 * 1024 * 1024
 
-# Import cleaning functions - define inline to avoid import issues
-import re
-
-def clean_phone(phone_str):
-    """Extract and clean the first phone number from a string."""
-    if not phone_str or phone_str.strip() == '':
-        return ''
-    phones = phone_str.split(',')
-    if not phones:
-        return ''
-    first_phone = phones[0].strip()
-    cleaned = re.sub(r'[^\d]', '', first_phone)
-    if len(cleaned) == 11 and cleaned.startswith('1'):
-        cleaned = cleaned[1:]
-    return cleaned
-
-def extract_first_email(email_str):
-    """Extract the first email from a comma-separated list."""
-    if not email_str or email_str.strip() == '':
-        return ''
-    emails = email_str.split(',')
-    if not emails:
-        return ''
-    return emails[0].strip()
-
-def clean_income_range(income_str):
-    """Replace commas with spaces in income range strings."""
-    if not income_str or income_str.strip() == '':
-        return ''
-    return income_str.replace(',', ' ')
-
-def get_primary_phone(row):
-    """Get primary phone from DIRECT_NUMBER, MOBILE_PHONE, or PERSONAL_PHONE."""
-    if row.get('DIRECT_NUMBER'):
-        phone = clean_phone(row['DIRECT_NUMBER'])
-        if phone:
-            return phone
-    if row.get('MOBILE_PHONE'):
-        phone = clean_phone(row['MOBILE_PHONE'])
-        if phone:
-            return phone
-    if row.get('PERSONAL_PHONE'):
-        phone = clean_phone(row['PERSONAL_PHONE'])
-        if phone:
-            return phone
-    return ''
-
-def get_primary_email(row):
-    """Get primary email from BUSINESS_EMAIL or first from PERSONAL_EMAILS."""
-    # Try BUSINESS_EMAIL first
-    if row.get('BUSINESS_EMAIL') and row['BUSINESS_EMAIL'].strip():
-        business_email = row['BUSINESS_EMAIL'].strip()
-        # Extract first email if it contains multiple emails
-        return extract_first_email(business_email)
-    
-    # Try PERSONAL_EMAILS
-    if row.get('PERSONAL_EMAILS'):
-        email = extract_first_email(row['PERSONAL_EMAILS'])
-        if email:
-            return email
-    return ''
-
-def generate_sha256(row, primary_email, primary_phone):
-    """Generate SHA256 hash from key identifying fields."""
-    # Combine key fields for hashing
-    hash_string = '|'.join([
-        str(row.get('FIRST_NAME', '')),
-        str(row.get('LAST_NAME', '')),
-        str(primary_email),
-        str(primary_phone),
-        str(row.get('UUID', ''))
-    ])
-    # Generate SHA256 hash
-    return hashlib.sha256(hash_string.encode('utf-8')).hexdigest()
-
-
-def process_csv_streaming(input_path, output_path, preview_rows=10):
+# Cleaning, enrichment, sorting and preview are shared with the CLI
+from clean_audience import (OUTPUT_COLUMNS, REFERENCE_INDEX_MAX_BYTES, SORT_MEMORY_BUDGET,
+                            read_cleaned_rows, enrich_rows, get_reference_columns, get_sort_columns,
+                            sort_rows, iter_lines, preview_csv)
+
+
+def process_csv_streaming(input_path, output_path, preview_rows=10, reference_path=None,
+                          join_key='PRIMARY_EMAIL', reference_key=None, reference_columns=None,
+                          sort_columns=None, dedupe=False, sort_memory=SORT_MEMORY_BUDGET,
+                          reference_memory=REFERENCE_INDEX_MAX_BYTES):
     """Process CSV file using streaming to handle large files.
-    Returns (rows_processed, preview_data) where preview_data is a list of dicts."""
-    output_columns = [
-        'FIRST_NAME', 'LAST_NAME', 'PRIMARY_PHONE', 'PRIMARY_EMAIL',
-        'Personal_Phone', 'Mobile_Phone', 'Valid_Phone', 'UUID',
-        'PERSONAL_CITY', 'PERSONAL_STATE', 'AGE_RANGE', 'CHILDREN',
-        'GENDER', 'HOMEOWNER', 'MARRIED', 'NET_WORTH', 'INCOME_RANGE',
-        'LINKEDIN_URL', 'SHA256'
-    ]
+    If reference_path is given, its reference_columns (already resolved with
+    get_reference_columns) are joined on join_key and appended to each row,
+    in memory if the index is estimated to fit in reference_memory bytes.
+    If sort_columns is given, output is sorted with an external merge sort,
+    optionally deduped on the sort key. Sorting and an on-disk join together
+    use about sort_memory bytes.
+    Returns (rows_processed, preview_data) where preview_data is a list of
+    row tuples in output column order (see preview_as_dicts)."""
+    output_columns = OUTPUT_COLUMNS
+    if reference_path:
+        output_columns = OUTPUT_COLUMNS + reference_columns
     
     rows_processed = 0
     preview_data = []
     
     try:
         with open(input_path, 'r', encoding='utf-8', errors='replace') as infile:
-            # Detect delimiter
-            sample = infile.read(1024)
-            infile.seek(0)
-            sniffer = csv.Sniffer()
-            delimiter = sniffer.sniff(sample).delimiter
-            
-            reader = csv.DictReader(infile, delimiter=delimiter)
+            rows = read_cleaned_rows(infile)
+            if reference_path and sort_columns:
+                # The join and the sort run at the same time and share the budget
+                sort_memory = max(sort_memory // 2, 1)
+            if reference_path:
+                rows = enrich_rows(rows, OUTPUT_COLUMNS, reference_path, join_key,
+                                   reference_key, reference_columns, reference_memory, sort_memory)
+            if sort_columns:
+                rows = sort_rows(rows, output_columns, sort_columns, dedupe, sort_memory)
             
             with open(output_path, 'w', encoding='utf-8', newline='') as outfile:
-                writer = csv.DictWriter(outfile, fieldnames=output_columns)
-                writer.writeheader()
+                writer = csv.writer(outfile)
+                writer.writerow(output_columns)
                 
-                for row in reader:
-                    # Get primary phone
-                    primary_phone = get_primary_phone(row)
-                    
-                    # Get personal and mobile phones
-                    personal_phone = clean_phone(row.get('PERSONAL_PHONE', ''))
-                    mobile_phone = clean_phone(row.get('MOBILE_PHONE', ''))
-                    
-                    # Get primary email
-                    primary_email = get_primary_email(row)
-                    
-                    # Clean income ranges
-                    net_worth = clean_income_range(row.get('NET_WORTH', ''))
-                    income_range = clean_income_range(row.get('INCOME_RANGE', ''))
-                    
-                    # Get LinkedIn URL (try common column name variations)
-                    linkedin_url = (row.get('LINKEDIN_URL', '') or 
-                                   row.get('LinkedIn_URL', '') or 
-                                   row.get('LINKEDIN', '') or 
-                                   row.get('LinkedIn', '') or 
-                                   row.get('linkedin_url', '') or '').strip()
-                    
-                    # Generate SHA256 hash
-                    sha256_hash = generate_sha256(row, primary_email, primary_phone)
-                    
-                    # Build output row
-                    output_row = {
-                        'FIRST_NAME': row.get('FIRST_NAME', ''),
-                        'LAST_NAME': row.get('LAST_NAME', ''),
-                        'PRIMARY_PHONE': primary_phone,
-                        'PRIMARY_EMAIL': primary_email,
-                        'Personal_Phone': personal_phone,
-                        'Mobile_Phone': mobile_phone,
-                        'Valid_Phone': primary_phone,
-                        'UUID': row.get('UUID', ''),
-                        'PERSONAL_CITY': row.get('PERSONAL_CITY', ''),
-                        'PERSONAL_STATE': row.get('PERSONAL_STATE', ''),
-                        'AGE_RANGE': row.get('AGE_RANGE', ''),
-                        'CHILDREN': row.get('CHILDREN', ''),
-                        'GENDER': row.get('GENDER', ''),
-                        'HOMEOWNER': row.get('HOMEOWNER', ''),
-                        'MARRIED': row.get('MARRIED', ''),
-                        'NET_WORTH': net_worth,
-                        'INCOME_RANGE': income_range,
-                        'LINKEDIN_URL': linkedin_url,
-                        'SHA256': sha256_hash
-                    }
-                    
+                for output_row in rows:
                     writer.writerow(output_row)
                     rows_processed += 1
                     
-                    # Collect preview data (first N rows)
+                    # Collect preview data (first N rows) as compact tuples
                     if len(preview_data) < preview_rows:
-                        preview_data.append(output_row)
+                        preview_data.append(tuple(output_row))
         
         return rows_processed, preview_data
     
@@ -195,6 +115,208 @@ def process_csv_streaming(input_path, output_path, preview_rows=10):
         raise Exception(f"Error processing file: {str(e)}")
 
 
+def preview_as_dicts(preview_data, columns):
+    """Turn preview row tuples into dicts keyed by column for the JSON response."""
+    return [dict(zip(columns, row)) for row in preview_data]
+
+
+def check_callback_url(callback_url, allowed_hosts=None):
+    """Raise ValueError unless callback_url is an http(s) URL we may POST to.
+    
+    With allowed_hosts, the host must be one of them. Otherwise every address
+    the host resolves to must be public, so callbacks cannot reach loopback,
+    private networks or cloud metadata endpoints.
+    """
+    parsed = urllib.parse.urlsplit(callback_url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        raise ValueError('callback_url must be an http(s) URL')
+    host = parsed.hostname.lower()
+    
+    if allowed_hosts:
+        if host not in allowed_hosts:
+            raise ValueError(f'callback_url host {host} is not allowed')
+        return
+    
+    try:
+        port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+        addresses = socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, ValueError):
+        raise ValueError(f'callback_url host {host} could not be resolved')
+    for address in addresses:
+        ip = ipaddress.ip_address(address[4][0].split('%')[0])
+        if getattr(ip, 'ipv4_mapped', None):
+            ip = ip.ipv4_mapped
+        if not ip.is_global:
+            raise ValueError('callback_url must not point to a private or internal address')
+
+
+class NoRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """Refuse redirects so a callback cannot be bounced to an internal address."""
+    
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+_callback_opener = urllib.request.build_opener(NoRedirectHandler)
+
+
+def deliver_callback(callback_url, payload, max_attempts=5, backoff_seconds=2, timeout=30,
+                     allowed_hosts=None):
+    """POST a JSON payload to callback_url, retrying failed deliveries with
+    exponential backoff. Returns True once the receiver answers with a 2xx."""
+    body = json.dumps(payload).encode('utf-8')
+    
+    for attempt in range(1, max_attempts + 1):
+        req = urllib.request.Request(
+            callback_url,
+            data=body,
+            headers={'Content-Type': 'application/json'},
+            method='POST'
+        )
+        try:
+            # Checked on every attempt, as DNS may have changed since /upload
+            check_callback_url(callback_url, allowed_hosts)
+            with _callback_opener.open(req, timeout=timeout) as response:
+                if 200 <= response.status < 300:
+                    return True
+                error_msg = f'HTTP {response.status}'
+        except urllib.error.HTTPError as e:
+            error_msg = f'HTTP {e.code}'
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            error_msg = str(e)
+        
+        print(f"Callback to {callback_url} failed (attempt {attempt}/{max_attempts}): {error_msg}")
+        if attempt < max_attempts:
+            time.sleep(backoff_seconds * (2 ** (attempt - 1)))
+    
+    return False
+
+
+# Per-worker pool for callback jobs, created on first use (after gunicorn forks)
+_job_executor = None
+_job_slots = None
+_job_pid = None
+_job_lock = threading.Lock()
+
+
+def submit_job(fn, *args):
+    """Run fn(*args) on this worker's bounded job pool.
+    Returns False, without running it, if all running and queued slots are taken."""
+    global _job_executor, _job_slots, _job_pid
+    with _job_lock:
+        if _job_executor is None or _job_pid != os.getpid():
+            from concurrent.futures import ThreadPoolExecutor
+            max_workers = app.config['CALLBACK_MAX_WORKERS']
+            _job_executor = ThreadPoolExecutor(max_workers=max_workers,
+                                               thread_name_prefix='callback-job')
+            _job_slots = threading.BoundedSemaphore(max_workers + app.config['CALLBACK_MAX_QUEUED'])
+            _job_pid = os.getpid()
+        executor, slots = _job_executor, _job_slots
+    
+    if not slots.acquire(blocking=False):
+        return False
+    future = executor.submit(fn, *args)
+    future.add_done_callback(lambda f: slots.release())
+    return True
+
+
+def shutdown_jobs():
+    """Wait for this worker's running and queued callback jobs to finish."""
+    if _job_executor is not None and _job_pid == os.getpid():
+        _job_executor.shutdown(wait=True)
+
+
+def run_callback_job(file_id, input_path, output_path, filename, callback_url,
+                     download_url, save_seconds, callback_options, process_options):
+    """Process an uploaded file in the background and POST the result to callback_url."""
+    started = time.time()
+    columns = OUTPUT_COLUMNS + (process_options.get('reference_columns') or [])
+    try:
+        rows_processed, preview_data = process_csv_streaming(input_path, output_path, **process_options)
+        payload = {
+            'success': True,
+            'file_id': file_id,
+            'rows_processed': rows_processed,
+            'preview': preview_as_dicts(preview_data, columns),
+            'columns': columns,
+            'filename': filename,
+            'file_size': os.path.getsize(output_path),
+            'download_url': download_url
+        }
+    except Exception as e:
+        print(f"Error processing file {file_id}: {e}")
+        if os.path.exists(output_path):
+            try:
+                os.remove(output_path)
+            except:
+                pass
+        payload = {
+            'success': False,
+            'file_id': file_id,
+            'error': f'Processing failed: {str(e)}'
+        }
+    finally:
+        for path in (input_path, process_options.get('reference_path')):
+            if path and os.path.exists(path):
+                try:
+                    os.remove(path)
+                except:
+                    pass
+    
+    processing_seconds = time.time() - started
+    payload['timings'] = {
+        'save_seconds': round(save_seconds, 3),
+        'processing_seconds': round(processing_seconds, 3),
+        'total_seconds': round(save_seconds + processing_seconds, 3)
+    }
+    
+    if not deliver_callback(callback_url, payload, **callback_options):
+        print(f"Giving up on callback for {file_id} to {callback_url}")
+
+
+def iter_upload_chunks(field_name='file', chunk_size=64 * 1024, max_bytes=None):
+    """Yield the bytes of an uploaded file straight from the request stream.
+    
+    multipart/form-data bodies are decoded incrementally and any other body is
+    treated as the raw file, so the app reads only as much of the upload as
+    the caller consumes. Stops after max_bytes of file data. Whether the
+    server then drains the unread rest depends on keep-alive (see
+    gunicorn.conf.py).
+    """
+    stream = request.stream
+    mimetype, options = parse_options_header(request.headers.get('Content-Type', ''))
+    remaining = max_bytes if max_bytes is not None else float('inf')
+    
+    if mimetype != 'multipart/form-data':
+        while remaining > 0:
+            chunk = stream.read(int(min(chunk_size, remaining)))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+        return
+    
+    decoder = MultipartDecoder(options.get('boundary', '').encode('latin-1'))
+    in_file = False
+    while remaining > 0:
+        chunk = stream.read(chunk_size)
+        decoder.receive_data(chunk or None)
+        event = decoder.next_event()
+        while not isinstance(event, (NeedData, Epilogue)):
+            if isinstance(event, (File, Field)):
+                in_file = isinstance(event, File) and event.name == field_name
+            elif isinstance(event, Data) and in_file:
+                data = event.data[:int(min(len(event.data), remaining))]
+                remaining -= len(data)
+                if data:
+                    yield data
+                if not event.more_data:
+                    return
+            event = decoder.next_event()
+        if isinstance(event, Epilogue) or not chunk:
+            return
+
+
 @app.route('/')
 def index():
     """Serve web interface or API documentation."""
@@ -215,9 +337,26 @@ def index():
                 'method': 'POST',
                 'description': 'Upload and process a CSV file',
                 'parameters': {
-                    'file': 'CSV file to process (multipart/form-data)'
+                    'file': 'CSV file to process (multipart/form-data)',
+                    'callback_url': 'Optional. Respond immediately and POST the result to this URL when cleaning finishes',
+                    'reference': 'Optional reference CSV to join (multipart/form-data)',
+                    'join_key': 'Optional. PRIMARY_EMAIL (default), PRIMARY_PHONE or UUID',
+                    'reference_key': 'Optional. Reference column holding the join key (default: join_key)',
+                    'reference_columns': 'Optional. Comma-separated reference columns to append (default: all)',
+                    'sort_by': 'Optional. Comma-separated output columns to sort by (e.g. PERSONAL_STATE,LAST_NAME)',
+                    'dedupe': 'Optional. "true" to keep only the first row per sort key'
+                },
+                'returns': 'Processed CSV file, or 202 with file_id when callback_url is set'
+            },
+            '/preview': {
+                'method': 'POST',
+                'description': 'Inspect the header and first rows of a CSV without uploading all of it',
+                'parameters': {
+                    'file': 'CSV file (multipart/form-data), or the raw CSV bytes as the request body',
+                    'rows': 'Optional query parameter. Number of rows to preview (default 10, max 100)',
+                    'partial': 'Optional query parameter. "true" if the body is a leading byte range of the file'
                 },
-                'returns': 'Processed CSV file'
+                'returns': 'Detected delimiter, matched/missing input columns and cleaned preview rows'
             },
             '/health': {
                 'method': 'GET',
@@ -231,11 +370,46 @@ def index():
 
 @app.route('/health', methods=['GET'])
 def health():
-    """Health check endpoint."""
-    return jsonify({
+    """Health check endpoint. Add ?verbose=1 for startup timings."""
+    status = {
         'status': 'healthy',
         'service': 'audience-cleaner-api'
-    })
+    }
+    if request.args.get('verbose'):
+        status['startup'] = STARTUP_STATS
+        status['uptime_seconds'] = round(time.time() - STARTUP_STATS['loaded_at'], 3)
+    return jsonify(status)
+
+
+@app.route('/preview', methods=['POST'])
+def preview_file():
+    """Report the layout and first cleaned rows of a CSV, reading only its head.
+    The app stops reading after the head; under gunicorn.conf.py (keepalive
+    off) the connection is then closed, so the rest of the upload is dropped."""
+    started = time.time()
+    try:
+        preview_rows = min(max(int(request.args.get('rows', 10)), 1), 100)
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'rows must be a whole number'
+        }), 400
+    partial = request.args.get('partial', '').lower() in ('1', 'true', 'yes')
+    
+    chunks = iter_upload_chunks(max_bytes=app.config['PREVIEW_MAX_BYTES'])
+    try:
+        report = preview_csv(iter_lines(chunks, drop_partial=partial), preview_rows)
+    except (ValueError, csv.Error) as e:
+        return jsonify({
+            'success': False,
+            'error': f'Could not read CSV: {str(e)}'
+        }), 400
+    finally:
+        chunks.close()
+    
+    report['success'] = True
+    report['elapsed_ms'] = round((time.time() - started) * 1000, 1)
+    return jsonify(report)
 
 
 @app.route('/download/<file_id>', methods=['GET'])
@@ -260,9 +434,7 @@ def download_file(file_id):
         )
     finally:
         # Clean up file after sending (with delay to ensure download started)
-        import threading
         def cleanup():
-            import time
             time.sleep(60)  # Wait 60 seconds before cleanup
             try:
                 if os.path.exists(output_path):
@@ -295,6 +467,16 @@ def upload_file():
             'error': 'File must be a CSV file'
         }), 400
     
+    callback_url = request.form.get('callback_url', '').strip()
+    if callback_url:
+        try:
+            check_callback_url(callback_url, app.config['CALLBACK_ALLOWED_HOSTS'])
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+    
     # Generate unique filenames
     file_id = str(uuid.uuid4())
     input_filename = secure_filename(f"{file_id}_input.csv")
@@ -302,16 +484,104 @@ def upload_file():
     
     input_path = os.path.join(app.config['UPLOAD_FOLDER'], input_filename)
     output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
+    reference_path = None
     
     try:
-        # Save uploaded file
+        # Save uploaded file (Flask has already received the body by now,
+        # so this times writing it to disk, not the network upload)
+        save_started = time.time()
         file.save(input_path)
+        save_seconds = time.time() - save_started
+        
+        # Save and validate the optional reference file for the enrichment join
+        process_options = {}
+        reference = request.files.get('reference')
+        if reference and reference.filename:
+            reference_path = os.path.join(app.config['UPLOAD_FOLDER'],
+                                          secure_filename(f"{file_id}_reference.csv"))
+            save_started = time.time()
+            reference.save(reference_path)
+            save_seconds += time.time() - save_started
+            join_key = request.form.get('join_key', 'PRIMARY_EMAIL').strip()
+            reference_key = request.form.get('reference_key', '').strip() or None
+            reference_columns = [c.strip() for c in request.form.get('reference_columns', '').split(',')
+                                 if c.strip()] or None
+            try:
+                reference_columns = get_reference_columns(reference_path, join_key, reference_key,
+                                                          reference_columns)
+            except ValueError as e:
+                for path in (input_path, reference_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                return jsonify({
+                    'success': False,
+                    'error': f'Invalid reference file: {str(e)}'
+                }), 400
+            process_options = {
+                'reference_path': reference_path,
+                'join_key': join_key,
+                'reference_key': reference_key,
+                'reference_columns': reference_columns,
+                'reference_memory': app.config['REFERENCE_INDEX_MAX_BYTES']
+            }
+        columns = OUTPUT_COLUMNS + (process_options.get('reference_columns') or [])
+        
+        # Optional external merge sort of the output
+        sort_by = request.form.get('sort_by', '').strip()
+        dedupe = request.form.get('dedupe', '').strip().lower() in ('1', 'true', 'yes')
+        if sort_by or dedupe:
+            try:
+                if not sort_by:
+                    raise ValueError("dedupe requires sort_by")
+                process_options['sort_columns'] = get_sort_columns(sort_by, columns)
+            except ValueError as e:
+                for path in (input_path, reference_path):
+                    if path and os.path.exists(path):
+                        os.remove(path)
+                return jsonify({
+                    'success': False,
+                    'error': f'Invalid sort: {str(e)}'
+                }), 400
+            process_options['dedupe'] = dedupe
+        # Also bounds the sort-merge join of large reference files
+        process_options['sort_memory'] = app.config['SORT_MEMORY_BUDGET']
+        
+        if callback_url:
+            # Respond immediately; the result is POSTed to callback_url when done
+            download_url = f"{request.host_url.rstrip('/')}/download/{file_id}"
+            callback_options = {
+                'max_attempts': app.config['CALLBACK_MAX_ATTEMPTS'],
+                'backoff_seconds': app.config['CALLBACK_BACKOFF_SECONDS'],
+                'timeout': app.config['CALLBACK_TIMEOUT'],
+                'allowed_hosts': app.config['CALLBACK_ALLOWED_HOSTS']
+            }
+            accepted = submit_job(
+                run_callback_job, file_id, input_path, output_path, f"cleaned_{file.filename}",
+                callback_url, download_url, save_seconds, callback_options, process_options
+            )
+            if not accepted:
+                for path in (input_path, reference_path):
+                    if path and os.path.exists(path):
+                        os.remove(path)
+                return jsonify({
+                    'success': False,
+                    'error': 'Too many files are being processed. Please retry shortly.'
+                }), 503
+            return jsonify({
+                'success': True,
+                'status': 'accepted',
+                'file_id': file_id,
+                'callback_url': callback_url,
+                'download_url': download_url
+            }), 202
         
         # Process the file (streaming, memory-efficient)
-        rows_processed, preview_data = process_csv_streaming(input_path, output_path)
+        rows_processed, preview_data = process_csv_streaming(input_path, output_path, **process_options)
         
-        # Clean up input file
+        # Clean up input and reference files
         os.remove(input_path)
+        if reference_path:
+            os.remove(reference_path)
         
         # Check file size - for large files, use download endpoint instead of base64
         file_size = os.path.getsize(output_path)
@@ -323,14 +593,8 @@ def upload_file():
             return jsonify({
                 'success': True,
                 'rows_processed': rows_processed,
-                'preview': preview_data,
-                'columns': [
-                    'FIRST_NAME', 'LAST_NAME', 'PRIMARY_PHONE', 'PRIMARY_EMAIL',
-                    'Personal_Phone', 'Mobile_Phone', 'Valid_Phone', 'UUID',
-                    'PERSONAL_CITY', 'PERSONAL_STATE', 'AGE_RANGE', 'CHILDREN',
-                    'GENDER', 'HOMEOWNER', 'MARRIED', 'NET_WORTH', 'INCOME_RANGE',
-                    'LINKEDIN_URL', 'SHA256'
-                ],
+                'preview': preview_as_dicts(preview_data, columns),
+                'columns': columns,
                 'file_id': file_id,
                 'filename': f"cleaned_{file.filename}",
                 'file_size': file_size,
@@ -354,36 +618,32 @@ def upload_file():
             return jsonify({
                 'success': True,
                 'rows_processed': rows_processed,
-                'preview': preview_data,
-                'columns': [
-                    'FIRST_NAME', 'LAST_NAME', 'PRIMARY_PHONE', 'PRIMARY_EMAIL',
-                    'Personal_Phone', 'Mobile_Phone', 'Valid_Phone', 'UUID',
-                    'PERSONAL_CITY', 'PERSONAL_STATE', 'AGE_RANGE', 'CHILDREN',
-                    'GENDER', 'HOMEOWNER', 'MARRIED', 'NET_WORTH', 'INCOME_RANGE',
-                    'LINKEDIN_URL', 'SHA256'
-                ],
+                'preview': preview_as_dicts(preview_data, columns),
+                'columns': columns,
                 'file_data': file_base64,
                 'filename': f"cleaned_{file.filename}"
             })
     
     except RequestEntityTooLarge:
         # Clean up on error
-        if os.path.exists(input_path):
-            try:
-                os.remove(input_path)
-            except:
-                pass
+        for path in (input_path, reference_path):
+            if path and os.path.exists(path):
+                try:
+                    os.remove(path)
+                except:
+                    pass
         return jsonify({
             'success': False,
             'error': 'File too large. Maximum size is 1GB'
         }), 413
     except Exception as e:
         # Clean up on error
-        if os.path.exists(input_path):
-            try:
-                os.remove(input_path)
-            except:
-                pass
+        for path in (input_path, reference_path):
+            if path and os.path.exists(path):
+                try:
+                    os.remove(path)
+                except:
+                    pass
         if os.path.exists(output_path):
             try:
                 os.remove(output_path)
@@ -431,6 +691,14 @@ def handle_exception(e):
     return jsonify({'error': f'An error occurred: {str(e)}'}), 500
 
 
+# Startup instrumentation - how long importing and configuring the app took
+STARTUP_STATS = {
+    'import_seconds': round(time.perf_counter() - _startup_started, 3),
+    'loaded_at': time.time()
+}
+print(f"⏱️  App loaded in {STARTUP_STATS['import_seconds']:.3f}s (pid {os.getpid()})", file=sys.stderr)
+
+
 if __name__ == '__main__':
     # Run the Flask app
     # Render uses PORT environment variable (defaults to 10000)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark for the Audience Cleaner web service
+Measures time from process launch to the first healthy /health response
+"""
+
+import http.client
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+# Target for a warm boot (files already in the OS page cache)
+TARGET_SECONDS = 1.0
+
+
+def free_port():
+    """Ask the OS for an unused TCP port."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def get_health(port, verbose=False):
+    """Return the parsed /health response, or None if the server is not up yet."""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+    try:
+        conn.request('GET', '/health?verbose=1' if verbose else '/health')
+        response = conn.getresponse()
+        if response.status != 200:
+            return None
+        return json.loads(response.read())
+    except (ConnectionError, OSError, http.client.HTTPException):
+        return None
+    finally:
+        conn.close()
+
+
+def time_to_healthy(command, timeout=60):
+    """Start the server and return (seconds until /health answered, startup stats)."""
+    port = free_port()
+    env = dict(os.environ, PORT=str(port))
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        command,
+        cwd=Path(__file__).parent,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"server exited with code {process.returncode}")
+            if get_health(port):
+                elapsed = time.perf_counter() - started
+                return elapsed, get_health(port, verbose=True).get('startup', {})
+            time.sleep(0.01)
+        raise RuntimeError(f"server not healthy after {timeout}s")
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def main():
+    """Run the benchmark. Usage: bench_startup.py [runs] [gunicorn|flask]"""
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    server = sys.argv[2] if len(sys.argv) > 2 else 'gunicorn'
+    if server == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app']
+    else:
+        command = [sys.executable, 'app.py']
+
+    print(f"⏱️  Startup benchmark ({server}, {runs} runs)")
+    print("=" * 50)
+
+    timings = []
+    for run in range(1, runs + 1):
+        elapsed, stats = time_to_healthy(command)
+        timings.append(elapsed)
+        print(f"Run {run}: healthy after {elapsed:.3f}s "
+              f"(app import {stats.get('import_seconds')}s)")
+
+    # The first run may be a cold boot; the rest are warm
+    warm = timings[1:] or timings
+    median = statistics.median(warm)
+    print(f"\nFirst run:   {timings[0]:.3f}s")
+    print(f"Warm median: {median:.3f}s (max {max(warm):.3f}s, target {TARGET_SECONDS:.1f}s)")
+
+    if median > TARGET_SECONDS:
+        print("❌ Warm boot is slower than the target")
+        return False
+    print("✅ Warm boot is within the target")
+    return True
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
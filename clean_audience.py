@@ -6,30 +6,82 @@ Handles files of any size by processing in chunks.
 """
 
 import csv
+import os
 import re
 import sys
+import codecs
+import heapq
 import hashlib
+import itertools
+import tempfile
+import threading
+from operator import itemgetter
 from pathlib import Path
 
 
+# Output columns in the correct order
+OUTPUT_COLUMNS = [
+    'FIRST_NAME', 'LAST_NAME', 'PRIMARY_PHONE', 'PRIMARY_EMAIL',
+    'Personal_Phone', 'Mobile_Phone', 'Valid_Phone', 'UUID',
+    'PERSONAL_CITY', 'PERSONAL_STATE', 'AGE_RANGE', 'CHILDREN',
+    'GENDER', 'HOMEOWNER', 'MARRIED', 'NET_WORTH', 'INCOME_RANGE',
+    'LINKEDIN_URL', 'SHA256'
+]
+
+# Input columns read by make_row_cleaner, in unpacking order (LinkedIn handled separately below)
+INPUT_COLUMNS = [
+    'FIRST_NAME', 'LAST_NAME', 'DIRECT_NUMBER', 'MOBILE_PHONE', 'PERSONAL_PHONE',
+    'BUSINESS_EMAIL', 'PERSONAL_EMAILS', 'UUID', 'PERSONAL_CITY', 'PERSONAL_STATE',
+    'AGE_RANGE', 'CHILDREN', 'GENDER', 'HOMEOWNER', 'MARRIED', 'NET_WORTH', 'INCOME_RANGE'
+]
+
+# LinkedIn column name variations, in order of preference
+LINKEDIN_COLUMNS = ['LINKEDIN_URL', 'LinkedIn_URL', 'LINKEDIN', 'LinkedIn', 'linkedin_url']
+
+# Cleaned columns a reference file can be joined on
+JOIN_KEYS = ['PRIMARY_EMAIL', 'PRIMARY_PHONE', 'UUID']
+
+# Reference files whose hash index is estimated to fit in this much memory are
+# joined in memory; larger ones fall back to an external sort-merge join that
+# spills to disk
+REFERENCE_INDEX_MAX_BYTES = 16 * 1024 * 1024
+
+# Approximate in-memory size of a hash index relative to its CSV file size
+# (dict slots, key strings and value tuples; measured at about 7x)
+REFERENCE_INDEX_MEMORY_FACTOR = 7
+
+# Approximate memory used by in-memory sort runs before spilling to disk
+SORT_MEMORY_BUDGET = 64 * 1024 * 1024
+
+# Most sorted runs kept open at once; beyond this, runs are merged into one
+# before sorting continues (keeps open file handles bounded)
+MAX_MERGE_RUNS = 256
+
+# Hash indexes of recently used reference files, keyed by file checksum, as
+# (index, estimated bytes); the cache holds at most _REFERENCE_INDEX_CACHE_BYTES
+_reference_index_cache = {}
+_reference_index_cache_lock = threading.Lock()
+_REFERENCE_INDEX_CACHE_BYTES = 32 * 1024 * 1024
+
+
+# Anything that is not a digit (same as [^\d])
+_NON_DIGITS = re.compile(r'\D')
+
+
 def clean_phone(phone_str):
     """Extract and clean the first phone number from a string."""
-    if not phone_str or phone_str.strip() == '':
-        return ''
-    
-    # Split by comma and get first phone
-    phones = phone_str.split(',')
-    if not phones:
+    if not phone_str:
         return ''
     
-    first_phone = phones[0].strip()
+    # Take the first phone without splitting the whole list
+    comma = phone_str.find(',')
+    first_phone = phone_str if comma == -1 else phone_str[:comma]
     
-    # Remove +, spaces, and other non-digit characters except the number itself
-    # Keep only digits
-    cleaned = re.sub(r'[^\d]', '', first_phone)
+    # Keep only digits (already-clean numbers are returned as-is)
+    cleaned = first_phone if first_phone.isdecimal() else _NON_DIGITS.sub('', first_phone)
     
     # Remove leading "1" for US phone numbers (11 digits -> 10 digits)
-    if len(cleaned) == 11 and cleaned.startswith('1'):
+    if len(cleaned) == 11 and cleaned[0] == '1':
         cleaned = cleaned[1:]
     
     return cleaned
@@ -37,14 +89,11 @@ def clean_phone(phone_str):
 
 def extract_first_email(email_str):
     """Extract the first email from a comma-separated list."""
-    if not email_str or email_str.strip() == '':
-        return ''
-    
-    emails = email_str.split(',')
-    if not emails:
+    if not email_str:
         return ''
     
-    return emails[0].strip()
+    comma = email_str.find(',')
+    return (email_str if comma == -1 else email_str[:comma]).strip()
 
 
 def clean_income_range(income_str):
@@ -55,6 +104,9 @@ def clean_income_range(income_str):
     return income_str.replace(',', ' ')
 
 
+# get_primary_phone, get_primary_email and generate_sha256 are the readable
+# reference for the per-row rules, on csv.DictReader rows. make_row_cleaner
+# inlines the same rules; test_clean_audience.py checks that the two agree.
 def get_primary_phone(row):
     """Get primary phone from DIRECT_NUMBER, MOBILE_PHONE, or PERSONAL_PHONE."""
     # Try DIRECT_NUMBER first
@@ -108,85 +160,503 @@ def generate_sha256(row, primary_email, primary_phone):
     return hashlib.sha256(hash_string.encode('utf-8')).hexdigest()
 
 
-def process_csv(input_file, output_file):
-    """Process the CSV file and create cleaned output."""
+def make_row_cleaner(header):
+    """Return a function that turns one csv.reader row into a cleaned output tuple.
+    
+    Column positions are resolved once from the header, so the per-row work
+    is a single itemgetter call plus the cleaning itself - no dict is built
+    for the input row or the output row. Values in the tuple follow
+    OUTPUT_COLUMNS. Short rows behave like csv.DictReader (missing trailing
+    values are None) so SHA256 values are unchanged.
+    """
+    # Later duplicates win, as with csv.DictReader
+    positions = {name: i for i, name in enumerate(header)}
+    width = len(header)
+    # Columns missing from the header read the '' appended to every row
+    getter = itemgetter(*[positions.get(c, width) for c in INPUT_COLUMNS + LINKEDIN_COLUMNS])
+    padding = [None] * width
+    sha256 = hashlib.sha256
+    
+    def clean(fields):
+        if len(fields) != width:
+            fields = (fields + padding)[:width]
+        fields.append('')
+        (first_name, last_name, direct_number, mobile_phone, personal_phone,
+         business_email, personal_emails, uuid, city, state, age_range, children,
+         gender, homeowner, married, net_worth, income_range,
+         linkedin_1, linkedin_2, linkedin_3, linkedin_4, linkedin_5) = getter(fields)
+        
+        # Phones: DIRECT_NUMBER, then MOBILE_PHONE, then PERSONAL_PHONE
+        mobile_phone = clean_phone(mobile_phone)
+        personal_phone = clean_phone(personal_phone)
+        primary_phone = clean_phone(direct_number) or mobile_phone or personal_phone
+        
+        # Email: BUSINESS_EMAIL, then first of PERSONAL_EMAILS
+        if business_email and business_email.strip():
+            primary_email = extract_first_email(business_email)
+        else:
+            primary_email = extract_first_email(personal_emails)
+        
+        # Get LinkedIn URL (try common column name variations)
+        linkedin_url = (linkedin_1 or linkedin_2 or linkedin_3 or linkedin_4 or
+                        linkedin_5 or '').strip()
+        
+        # Same fields and format as generate_sha256 (None prints as 'None')
+        sha256_hash = sha256(
+            f'{first_name}|{last_name}|{primary_email}|{primary_phone}|{uuid}'.encode('utf-8')
+        ).hexdigest()
+        
+        return (
+            first_name or '', last_name or '', primary_phone, primary_email,
+            personal_phone, mobile_phone, primary_phone, uuid or '',
+            city or '', state or '', age_range or '', children or '',
+            gender or '', homeowner or '', married or '',
+            clean_income_range(net_worth), clean_income_range(income_range),
+            linkedin_url, sha256_hash
+        )
+    
+    return clean
+
+
+def read_cleaned_rows(infile):
+    """Detect the delimiter of an open CSV file and yield cleaned output tuples."""
+    # Detect delimiter
+    sample = infile.read(1024)
+    infile.seek(0)
+    sniffer = csv.Sniffer()
+    delimiter = sniffer.sniff(sample).delimiter
+    
+    reader = csv.reader(infile, delimiter=delimiter)
+    header = next(reader, [])
+    # Blank lines are skipped, as csv.DictReader does
+    return map(make_row_cleaner(header), filter(None, reader))
+
+
+def _merge_runs(runs, key, tmp_dir):
+    """Merge sorted run files into a single new run file and close the old ones."""
+    merged = tempfile.TemporaryFile(mode='w+', encoding='utf-8', newline='', dir=tmp_dir)
+    csv.writer(merged).writerows(heapq.merge(*[csv.reader(run) for run in runs], key=key))
+    merged.seek(0)
+    for run in runs:
+        run.close()
+    return merged
+
+
+def external_sort(records, key, memory_budget=SORT_MEMORY_BUDGET, tmp_dir=None,
+                  max_runs=MAX_MERGE_RUNS):
+    """Sort an iterable of string lists, spilling sorted runs to temp files.
+    
+    Records are buffered until their approximate size exceeds memory_budget,
+    then each run is sorted and written to a temp CSV file. The runs are
+    combined with a k-way heap merge; whenever max_runs runs are on disk they
+    are first merged into one, so at most max_runs files are open at once.
+    Equal keys keep their input order. Raises ValueError if memory_budget is
+    not positive or max_runs is less than 2.
+    """
+    if memory_budget <= 0:
+        raise ValueError("sort memory budget must be positive")
+    if max_runs < 2:
+        raise ValueError("max_runs must be at least 2")
+    
+    runs = []
+    buffer = []
+    buffered_bytes = 0
+    
+    try:
+        for record in records:
+            buffer.append(record)
+            # Rough per-string overhead of a Python str plus the list slot
+            buffered_bytes += sum(map(len, record)) + 64 * len(record)
+            if buffered_bytes >= memory_budget:
+                buffer.sort(key=key)
+                run = tempfile.TemporaryFile(mode='w+', encoding='utf-8', newline='', dir=tmp_dir)
+                csv.writer(run).writerows(buffer)
+                run.seek(0)
+                runs.append(run)
+                if len(runs) >= max_runs:
+                    # Earlier runs hold earlier records, so merging them in
+                    # order keeps the sort stable
+                    runs = [_merge_runs(runs, key, tmp_dir)]
+                buffer = []
+                buffered_bytes = 0
+        
+        buffer.sort(key=key)
+        if not runs:
+            # Everything fit in memory - no merge needed
+            yield from buffer
+            return
+        
+        iterators = [csv.reader(run) for run in runs]
+        iterators.append(iter(buffer))
+        yield from heapq.merge(*iterators, key=key)
+    finally:
+        for run in runs:
+            run.close()
+
+
+def normalize_join_key(join_key, value):
+    """Normalize a join key value so cleaned rows and reference rows compare equal."""
+    if not value:
+        return ''
+    if join_key == 'PRIMARY_PHONE':
+        return clean_phone(value)
+    if join_key == 'PRIMARY_EMAIL':
+        return extract_first_email(value).lower()
+    return value.strip()
+
+
+def file_checksum(path):
+    """Return the SHA256 checksum of a file, read in 1MB blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def open_reference(reference_file):
+    """Open a reference CSV and return (file, DictReader) with the delimiter detected."""
+    f = open(reference_file, 'r', encoding='utf-8', errors='replace', newline='')
+    sample = f.read(1024)
+    f.seek(0)
+    try:
+        delimiter = csv.Sniffer().sniff(sample).delimiter
+    except csv.Error:
+        delimiter = ','
+    return f, csv.DictReader(f, delimiter=delimiter)
+
+
+def get_reference_columns(reference_file, join_key='PRIMARY_EMAIL', reference_key=None,
+                          reference_columns=None):
+    """Validate join settings and return the reference columns to append to the output.
+    
+    reference_key is the reference column holding the join key (defaults to join_key).
+    reference_columns defaults to every reference column except reference_key.
+    Raises ValueError if the settings do not match the reference file.
+    """
+    if join_key not in JOIN_KEYS:
+        raise ValueError(f"join key must be one of {', '.join(JOIN_KEYS)}")
+    reference_key = reference_key or join_key
+    
+    f, reader = open_reference(reference_file)
+    with f:
+        header = reader.fieldnames or []
+    
+    if reference_key not in header:
+        raise ValueError(f"reference file has no '{reference_key}' column")
+    
+    if reference_columns:
+        missing = [c for c in reference_columns if c not in header]
+        if missing:
+            raise ValueError(f"reference file has no column(s): {', '.join(missing)}")
+        columns = list(reference_columns)
+    else:
+        columns = [c for c in header if c != reference_key]
+    
+    clashing = [c for c in columns if c in OUTPUT_COLUMNS]
+    if clashing:
+        raise ValueError(f"reference column(s) already in output: {', '.join(clashing)}")
+    return columns
+
+
+def estimate_index_bytes(reference_file):
+    """Estimate the memory a hash index of reference_file would use."""
+    return os.path.getsize(reference_file) * REFERENCE_INDEX_MEMORY_FACTOR
+
+
+def load_reference_index(reference_file, join_key, reference_key, reference_columns):
+    """Build (or fetch from cache) a hash index of normalized key -> reference values.
+    
+    Indexes are cached by file checksum, so the same reference uploaded again
+    under a different name is not re-read. The first row for each key wins.
+    The cache is bounded by estimated total bytes, evicting the oldest first.
+    """
+    cache_key = (file_checksum(reference_file), join_key, reference_key, tuple(reference_columns))
+    with _reference_index_cache_lock:
+        cached = _reference_index_cache.get(cache_key)
+    if cached is not None:
+        return cached[0]
+    
+    index = {}
+    f, reader = open_reference(reference_file)
+    with f:
+        for ref_row in reader:
+            key = normalize_join_key(join_key, ref_row.get(reference_key))
+            if key and key not in index:
+                index[key] = tuple(ref_row.get(c) or '' for c in reference_columns)
+    
+    size = estimate_index_bytes(reference_file)
+    if size <= _REFERENCE_INDEX_CACHE_BYTES:
+        with _reference_index_cache_lock:
+            _reference_index_cache.pop(cache_key, None)
+            while _reference_index_cache and (
+                    sum(cached_size for _, cached_size in _reference_index_cache.values()) + size
+                    > _REFERENCE_INDEX_CACHE_BYTES):
+                _reference_index_cache.pop(next(iter(_reference_index_cache)))
+            _reference_index_cache[cache_key] = (index, size)
+    return index
+
+
+def _sort_merge_join(rows, fieldnames, reference_file, join_key, reference_key,
+                     reference_columns, memory_budget, tmp_dir):
+    """Join rows against a reference file too large to index in memory.
+    
+    Both sides are sorted on the normalized key with external_sort, merged,
+    and the joined rows are sorted back into their original order. The three
+    sorts run at the same time, so each gets a third of memory_budget.
+    """
+    memory_budget = max(memory_budget // 3, 1)
+    key_pos = fieldnames.index(join_key)
+    blanks = [''] * len(reference_columns)
+    
+    def cleaned_records():
+        for seq, row in enumerate(rows):
+            yield [normalize_join_key(join_key, row[key_pos]), *row, str(seq)]
+    
+    def reference_records():
+        f, reader = open_reference(reference_file)
+        with f:
+            for ref_row in reader:
+                key = normalize_join_key(join_key, ref_row.get(reference_key))
+                if key:
+                    yield [key] + [ref_row.get(c) or '' for c in reference_columns]
+    
+    def joined_records():
+        references = external_sort(reference_records(), key=lambda r: r[0],
+                                   memory_budget=memory_budget, tmp_dir=tmp_dir)
+        ref = next(references, None)
+        for record in external_sort(cleaned_records(), key=lambda r: r[0],
+                                    memory_budget=memory_budget, tmp_dir=tmp_dir):
+            key = record[0]
+            while ref is not None and ref[0] < key:
+                ref = next(references, None)
+            matched = ref[1:] if key and ref is not None and ref[0] == key else blanks
+            # Keep the sequence number last so the original order can be restored
+            yield record[1:-1] + matched + record[-1:]
+    
+    for record in external_sort(joined_records(), key=lambda r: int(r[-1]),
+                                memory_budget=memory_budget, tmp_dir=tmp_dir):
+        del record[-1]
+        yield record
+
+
+def enrich_rows(rows, fieldnames, reference_file, join_key='PRIMARY_EMAIL', reference_key=None,
+                reference_columns=None, index_max_bytes=REFERENCE_INDEX_MAX_BYTES,
+                memory_budget=SORT_MEMORY_BUDGET, tmp_dir=None):
+    """Join cleaned rows against a reference file, appending reference_columns.
+    
+    rows are sequences of values in fieldnames order (e.g. the tuples from
+    make_row_cleaner); each is yielded with the matched reference values
+    appended. If the reference's hash index is estimated to fit in
+    index_max_bytes, a cached in-memory index is used and rows stream one
+    by one. Otherwise an external sort-merge join using about memory_budget
+    bytes is used; output order is the same. reference_columns must already
+    be resolved with get_reference_columns.
+    """
+    reference_key = reference_key or join_key
+    
+    if estimate_index_bytes(reference_file) > index_max_bytes:
+        yield from _sort_merge_join(rows, fieldnames, reference_file, join_key, reference_key,
+                                    reference_columns, memory_budget, tmp_dir)
+        return
+    
+    index = load_reference_index(reference_file, join_key, reference_key, reference_columns)
+    blanks = ('',) * len(reference_columns)
+    key_pos = fieldnames.index(join_key)
+    for row in rows:
+        yield tuple(row) + index.get(normalize_join_key(join_key, row[key_pos]), blanks)
+
+
+def iter_lines(chunks, drop_partial=False):
+    """Decode an iterable of UTF-8 byte chunks into text lines (line breaks kept).
+    
+    Line endings are translated as in universal-newlines mode, the way
+    process_csv opens files: '\r\n', '\r' and '\n' all become '\n'. Only as
+    many chunks are pulled as the caller consumes. With drop_partial, a final
+    line without a line break is discarded - use this when the input is a
+    leading byte range of a larger file.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    pending = ''
+    for chunk in chunks:
+        text = pending + decoder.decode(chunk)
+        # A trailing '\r' may be the first half of a '\r\n' split across chunks
+        held = '\r' if text.endswith('\r') else ''
+        if held:
+            text = text[:-1]
+        lines = text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+        pending = lines.pop() + held
+        for line in lines:
+            yield line + '\n'
+    pending += decoder.decode(b'', final=True)
+    lines = pending.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    pending = lines.pop()
+    for line in lines:
+        yield line + '\n'
+    if pending and not drop_partial:
+        yield pending
+
+
+def preview_csv(lines, preview_rows=10):
+    """Inspect the head of a CSV without reading the rest of it.
+    
+    lines is an iterable of text lines (an open file, or iter_lines over an
+    upload stream); only the header and the first preview_rows records are
+    consumed. Returns a dict with the detected delimiter, the input columns
+    matched and missing, the LinkedIn column variant found, and the cleaned
+    preview rows.
+    """
+    lines = iter(lines)
+    
+    # Buffer enough whole lines to detect the delimiter like process_csv does
+    head = []
+    sample_size = 0
+    for line in lines:
+        head.append(line)
+        sample_size += len(line)
+        if sample_size >= 1024 or len(head) > preview_rows:
+            break
+    if not head:
+        raise ValueError("file is empty")
+    
+    delimiter = csv.Sniffer().sniff(''.join(head)[:1024]).delimiter
+    reader = csv.reader(itertools.chain(head, lines), delimiter=delimiter)
+    header = next(reader, [])
+    clean = make_row_cleaner(header)
+    
+    preview = []
+    try:
+        for fields in itertools.islice(filter(None, reader), preview_rows):
+            preview.append(dict(zip(OUTPUT_COLUMNS, clean(fields))))
+    except csv.Error:
+        # A record cut off at the end of a byte range
+        pass
+    
+    linkedin_column = next((c for c in LINKEDIN_COLUMNS if c in header), None)
+    missing = [c for c in INPUT_COLUMNS if c not in header]
+    if linkedin_column is None:
+        missing.append('LINKEDIN_URL')
+    
+    return {
+        'delimiter': delimiter,
+        'input_columns': header,
+        'matched_columns': [c for c in INPUT_COLUMNS if c in header],
+        'missing_columns': missing,
+        'linkedin_column': linkedin_column,
+        'columns': OUTPUT_COLUMNS,
+        'rows_previewed': len(preview),
+        'preview': preview
+    }
+
+
+def print_preview(input_file, preview_rows=10):
+    """Print the preview_csv report for a local file, reading only its head."""
+    try:
+        with open(input_file, 'r', encoding='utf-8', errors='replace', newline='') as infile:
+            report = preview_csv(infile, preview_rows)
+    except (ValueError, csv.Error) as e:
+        print(f"Error previewing file: {e}")
+        sys.exit(1)
+    
+    print(f"Preview of: {input_file}")
+    print(f"Delimiter: {report['delimiter']!r}")
+    print(f"Input columns: {len(report['input_columns'])}")
+    print(f"Matched columns: {', '.join(report['matched_columns']) or '(none)'}")
+    print(f"Missing columns: {', '.join(report['missing_columns']) or '(none)'}")
+    print(f"LinkedIn column: {report['linkedin_column'] or '(not found)'}")
+    print(f"\nFirst {report['rows_previewed']} cleaned rows:\n")
+    
+    writer = csv.DictWriter(sys.stdout, fieldnames=report['columns'])
+    writer.writeheader()
+    writer.writerows(report['preview'])
+
+
+def get_sort_columns(sort_by, fieldnames):
+    """Parse a comma-separated sort_by string into a list of output columns.
+    Raises ValueError if a column is not in fieldnames."""
+    columns = [c.strip() for c in sort_by.split(',') if c.strip()]
+    if not columns:
+        raise ValueError("no sort columns given")
+    unknown = [c for c in columns if c not in fieldnames]
+    if unknown:
+        raise ValueError(f"cannot sort by unknown column(s): {', '.join(unknown)}")
+    return columns
+
+
+def sort_rows(rows, fieldnames, sort_columns, dedupe=False, memory_budget=SORT_MEMORY_BUDGET,
+              tmp_dir=None):
+    """Sort cleaned rows (sequences in fieldnames order) on sort_columns with
+    an external merge sort.
+    
+    Memory use is bounded by memory_budget; sorted runs are spilled to temp
+    files and heap-merged. With dedupe, only the first row (in input order)
+    for each sort key is kept, dropped as the runs are merged. Rows whose
+    sort key is entirely blank are never treated as duplicates.
+    """
+    positions = [fieldnames.index(c) for c in sort_columns]
+    
+    def key(record):
+        return [record[i] for i in positions]
+    
+    previous = None
+    for record in external_sort(rows, key, memory_budget=memory_budget, tmp_dir=tmp_dir):
+        if dedupe:
+            current = key(record)
+            if current == previous and any(current):
+                continue
+            previous = current
+        yield record
+
+
+def process_csv(input_file, output_file, reference_file=None, join_key='PRIMARY_EMAIL',
+                reference_key=None, reference_columns=None, sort_by=None, dedupe=False,
+                sort_memory=SORT_MEMORY_BUDGET, reference_memory=REFERENCE_INDEX_MAX_BYTES):
+    """Process the CSV file and create cleaned output.
+    
+    If reference_file is given, it is joined on join_key (PRIMARY_EMAIL,
+    PRIMARY_PHONE or UUID) and its reference_columns are appended to the output.
+    The join uses an in-memory index if it is estimated to fit in
+    reference_memory bytes, otherwise a sort-merge join spilling to disk.
+    If sort_by is given (comma-separated output columns), the output is sorted
+    with an external merge sort, optionally keeping only the first row per
+    sort key (dedupe). Sorting and the on-disk join together use about
+    sort_memory bytes.
+    """
     
     print(f"Reading input file: {input_file}")
     print(f"Writing output file: {output_file}")
     
-    # Output columns in the correct order
-    output_columns = [
-        'FIRST_NAME', 'LAST_NAME', 'PRIMARY_PHONE', 'PRIMARY_EMAIL',
-        'Personal_Phone', 'Mobile_Phone', 'Valid_Phone', 'UUID',
-        'PERSONAL_CITY', 'PERSONAL_STATE', 'AGE_RANGE', 'CHILDREN',
-        'GENDER', 'HOMEOWNER', 'MARRIED', 'NET_WORTH', 'INCOME_RANGE',
-        'LINKEDIN_URL', 'SHA256'
-    ]
+    output_columns = OUTPUT_COLUMNS
     
     rows_processed = 0
     
     try:
+        if reference_file:
+            print(f"Joining reference file: {reference_file} on {join_key}")
+            reference_columns = get_reference_columns(reference_file, join_key, reference_key,
+                                                      reference_columns)
+            output_columns = OUTPUT_COLUMNS + reference_columns
+        
+        if sort_by:
+            sort_columns = get_sort_columns(sort_by, output_columns)
+            print(f"Sorting by: {', '.join(sort_columns)}" + (" (dedupe)" if dedupe else ""))
+        
         with open(input_file, 'r', encoding='utf-8', errors='replace') as infile:
-            # Detect delimiter
-            sample = infile.read(1024)
-            infile.seek(0)
-            sniffer = csv.Sniffer()
-            delimiter = sniffer.sniff(sample).delimiter
-            
-            reader = csv.DictReader(infile, delimiter=delimiter)
+            rows = read_cleaned_rows(infile)
+            if reference_file and sort_by:
+                # The join and the sort run at the same time and share the budget
+                sort_memory = max(sort_memory // 2, 1)
+            if reference_file:
+                rows = enrich_rows(rows, OUTPUT_COLUMNS, reference_file, join_key,
+                                   reference_key, reference_columns, reference_memory, sort_memory)
+            if sort_by:
+                rows = sort_rows(rows, output_columns, sort_columns, dedupe, sort_memory)
             
             with open(output_file, 'w', encoding='utf-8', newline='') as outfile:
-                writer = csv.DictWriter(outfile, fieldnames=output_columns)
-                writer.writeheader()
+                writer = csv.writer(outfile)
+                writer.writerow(output_columns)
                 
-                for row in reader:
-                    # Get primary phone
-                    primary_phone = get_primary_phone(row)
-                    
-                    # Get personal and mobile phones
-                    personal_phone = clean_phone(row.get('PERSONAL_PHONE', ''))
-                    mobile_phone = clean_phone(row.get('MOBILE_PHONE', ''))
-                    
-                    # Get primary email
-                    primary_email = get_primary_email(row)
-                    
-                    # Clean income ranges
-                    net_worth = clean_income_range(row.get('NET_WORTH', ''))
-                    income_range = clean_income_range(row.get('INCOME_RANGE', ''))
-                    
-                    # Get LinkedIn URL (try common column name variations)
-                    linkedin_url = (row.get('LINKEDIN_URL', '') or 
-                                   row.get('LinkedIn_URL', '') or 
-                                   row.get('LINKEDIN', '') or 
-                                   row.get('LinkedIn', '') or 
-                                   row.get('linkedin_url', '') or '').strip()
-                    
-                    # Generate SHA256 hash
-                    sha256_hash = generate_sha256(row, primary_email, primary_phone)
-                    
-                    # Build output row
-                    output_row = {
-                        'FIRST_NAME': row.get('FIRST_NAME', ''),
-                        'LAST_NAME': row.get('LAST_NAME', ''),
-                        'PRIMARY_PHONE': primary_phone,
-                        'PRIMARY_EMAIL': primary_email,
-                        'Personal_Phone': personal_phone,
-                        'Mobile_Phone': mobile_phone,
-                        'Valid_Phone': primary_phone,  # Same as primary phone
-                        'UUID': row.get('UUID', ''),
-                        'PERSONAL_CITY': row.get('PERSONAL_CITY', ''),
-                        'PERSONAL_STATE': row.get('PERSONAL_STATE', ''),
-                        'AGE_RANGE': row.get('AGE_RANGE', ''),
-                        'CHILDREN': row.get('CHILDREN', ''),
-                        'GENDER': row.get('GENDER', ''),
-                        'HOMEOWNER': row.get('HOMEOWNER', ''),
-                        'MARRIED': row.get('MARRIED', ''),
-                        'NET_WORTH': net_worth,
-                        'INCOME_RANGE': income_range,
-                        'LINKEDIN_URL': linkedin_url,
-                        'SHA256': sha256_hash
-                    }
-                    
+                for output_row in rows:
                     writer.writerow(output_row)
                     rows_processed += 1
                     
@@ -205,27 +675,95 @@ def process_csv(input_file, output_file):
         sys.exit(1)
 
 
+def print_usage():
+    """Print command line usage."""
+    print("Audience Cleaner - Clean and transform Audience Lab CSV files")
+    print("=" * 60)
+    print("\nUsage:")
+    print("  clean-audience <input_file.csv> [output_file.csv] [options]")
+    print("\nExamples:")
+    print("  clean-audience test2.csv")
+    print("  clean-audience test2.csv cleaned_output.csv")
+    print("  clean-audience ~/Downloads/large_file.csv")
+    print("  clean-audience test2.csv --reference crm_export.csv --join-key PRIMARY_EMAIL")
+    print("  clean-audience test2.csv --sort-by PERSONAL_STATE,LAST_NAME")
+    print("  clean-audience ~/Downloads/large_file.csv --preview")
+    print("\nOptions:")
+    print("  -h, --help                  Show this help message")
+    print("  --reference FILE            Join a reference CSV (CRM export, ZIP/city lookup, ...)")
+    print("  --join-key KEY              PRIMARY_EMAIL (default), PRIMARY_PHONE or UUID")
+    print("  --reference-key COLUMN      Reference column holding the key (default: same as --join-key)")
+    print("  --reference-columns A,B     Reference columns to append (default: all)")
+    print("  --reference-memory MB       Memory for an in-memory reference index, else join on disk (default: 16)")
+    print("  --sort-by A,B               Sort output by these columns (e.g. PERSONAL_STATE, LAST_NAME, SHA256)")
+    print("  --dedupe                    With --sort-by, keep only the first row per sort key")
+    print("  --sort-memory MB            Memory budget for sorting before spilling to disk (default: 64)")
+    print("  --preview                   Only inspect the header and first rows; no output file is written")
+    print("  --preview-rows N            Number of rows to preview (default: 10)")
+    print("\nFor more information, see README.md")
+
+
+# Command line options that take a value
+VALUE_OPTIONS = ['--reference', '--join-key', '--reference-key', '--reference-columns',
+                 '--reference-memory', '--sort-by', '--sort-memory', '--preview-rows']
+
+# Command line options that are on/off switches
+FLAG_OPTIONS = ['--dedupe', '--preview']
+
+
 def main():
     """Main function to handle command line arguments."""
     if len(sys.argv) < 2 or sys.argv[1] in ['-h', '--help', 'help']:
-        print("Audience Cleaner - Clean and transform Audience Lab CSV files")
-        print("=" * 60)
-        print("\nUsage:")
-        print("  clean-audience <input_file.csv> [output_file.csv]")
-        print("\nExamples:")
-        print("  clean-audience test2.csv")
-        print("  clean-audience test2.csv cleaned_output.csv")
-        print("  clean-audience ~/Downloads/large_file.csv")
-        print("\nOptions:")
-        print("  -h, --help    Show this help message")
-        print("\nFor more information, see README.md")
+        print_usage()
         sys.exit(0)
     
-    input_file = sys.argv[1]
+    # Split options from positional arguments
+    args = sys.argv[1:]
+    options = {}
+    positional = []
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg in ['-h', '--help']:
+            print_usage()
+            sys.exit(0)
+        if arg in VALUE_OPTIONS:
+            if i + 1 >= len(args):
+                print(f"Error: {arg} requires a value.")
+                sys.exit(1)
+            options[arg] = args[i + 1]
+            i += 2
+        elif arg in FLAG_OPTIONS:
+            options[arg] = True
+            i += 1
+        elif arg.startswith('--'):
+            print(f"Error: Unknown option '{arg}'. Use --help for usage.")
+            sys.exit(1)
+        else:
+            positional.append(arg)
+            i += 1
+    
+    if not positional:
+        print_usage()
+        sys.exit(1)
+    
+    input_file = positional[0]
+    
+    if options.get('--preview') or '--preview-rows' in options:
+        if not Path(input_file).exists():
+            print(f"Error: Input file '{input_file}' does not exist.")
+            sys.exit(1)
+        try:
+            preview_rows = int(options.get('--preview-rows', 10))
+        except ValueError:
+            print("Error: --preview-rows must be a whole number.")
+            sys.exit(1)
+        print_preview(input_file, preview_rows)
+        sys.exit(0)
     
     # Generate output filename if not provided
-    if len(sys.argv) >= 3:
-        output_file = sys.argv[2]
+    if len(positional) >= 2:
+        output_file = positional[1]
     else:
         input_path = Path(input_file)
         output_file = str(input_path.parent / f"cleaned_{input_path.stem}.csv")
@@ -235,7 +773,47 @@ def main():
         print(f"Error: Input file '{input_file}' does not exist.")
         sys.exit(1)
     
-    process_csv(input_file, output_file)
+    reference_file = options.get('--reference')
+    if reference_file and not Path(reference_file).exists():
+        print(f"Error: Reference file '{reference_file}' does not exist.")
+        sys.exit(1)
+    
+    if options.get('--dedupe') and not options.get('--sort-by'):
+        print("Error: --dedupe requires --sort-by.")
+        sys.exit(1)
+    
+    try:
+        sort_memory = int(float(options.get('--sort-memory', SORT_MEMORY_BUDGET / (1024 * 1024))) * 1024 * 1024)
+    except ValueError:
+        print("Error: --sort-memory must be a number of megabytes.")
+        sys.exit(1)
+    if sort_memory <= 0:
+        print("Error: --sort-memory must be greater than zero.")
+        sys.exit(1)
+    
+    try:
+        reference_memory = int(float(options.get('--reference-memory',
+                                                 REFERENCE_INDEX_MAX_BYTES / (1024 * 1024))) * 1024 * 1024)
+    except ValueError:
+        print("Error: --reference-memory must be a number of megabytes.")
+        sys.exit(1)
+    if reference_memory < 0:
+        print("Error: --reference-memory must not be negative.")
+        sys.exit(1)
+    
+    reference_columns = options.get('--reference-columns')
+    process_csv(
+        input_file,
+        output_file,
+        reference_file=reference_file,
+        join_key=options.get('--join-key', 'PRIMARY_EMAIL'),
+        reference_key=options.get('--reference-key'),
+        reference_columns=[c.strip() for c in reference_columns.split(',')] if reference_columns else None,
+        sort_by=options.get('--sort-by'),
+        dedupe=options.get('--dedupe', False),
+        sort_memory=sort_memory,
+        reference_memory=reference_memory
+    )
 
 
 if __name__ == '__main__':
@@ -0,0 +1,35 @@
+"""
+Gunicorn settings for the Audience Cleaner web service
+
+preload_app imports the app once in the master process; workers are forked
+from it and share the already-loaded modules instead of each importing
+Flask and the cleaning code on their own.
+
+keepalive is off so each connection is closed once its response is sent.
+With keep-alive, gunicorn reads and discards any unread request body before
+the next request, so a /preview of a 500MB upload would still receive all
+500MB; closing the connection stops the upload instead.
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 2))
+timeout = 600
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 120))
+preload_app = True
+keepalive = 0
+
+
+def when_ready(server):
+    """Log how long the preloaded app took to import, before workers are forked."""
+    from app import STARTUP_STATS
+    server.log.info("App imported in %.3fs", STARTUP_STATS['import_seconds'])
+
+
+def worker_exit(server, worker):
+    """Let queued callback jobs finish before the worker goes away.
+    gunicorn still kills the worker once graceful_timeout has passed."""
+    from app import shutdown_jobs
+    shutdown_jobs()
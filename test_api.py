@@ -3,10 +3,41 @@
 Test script for the Audience Cleaner API
 """
 
+import json
+import queue
 import requests
 import sys
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
 from pathlib import Path
 
+
+def start_callback_receiver(fail_first=0):
+    """Start a local stub webhook receiver. Returns (server, received_queue).
+    The first `fail_first` deliveries are answered with HTTP 500 to exercise retries.
+    It listens on 127.0.0.1, so the app only calls it with CALLBACK_ALLOWED_HOSTS set."""
+    received = queue.Queue()
+    attempts = {'count': 0}
+    
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            attempts['count'] += 1
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if attempts['count'] <= fail_first:
+                self.send_response(500)
+                self.end_headers()
+                return
+            received.put(json.loads(body))
+            self.send_response(200)
+            self.end_headers()
+        
+        def log_message(self, format, *args):
+            pass
+    
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, received
+
 def test_api(base_url="http://localhost:5000"):
     """Test the API endpoints."""
     
@@ -55,6 +86,8 @@ def test_api(base_url="http://localhost:5000"):
 
 if __name__ == '__main__':
     base_url = sys.argv[1] if len(sys.argv) > 1 else "http://localhost:5000"
+    # Completion callbacks are covered by test_app.py (pytest), which can allow
+    # its loopback stub receiver through CALLBACK_ALLOWED_HOSTS
     success = test_api(base_url)
     sys.exit(0 if success else 1)
 
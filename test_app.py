@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Tests for the Audience Cleaner web API
+Run with pytest; uses Flask's test client and a local stub webhook receiver
+"""
+
+import io
+import os
+import queue
+import socket
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+import app as web
+from bench_startup import free_port, get_health
+from test_api import start_callback_receiver
+
+SAMPLE_CSV = (
+    "FIRST_NAME,LAST_NAME,DIRECT_NUMBER,BUSINESS_EMAIL,UUID\n"
+    "A,B,+1 555 123 4567,a@x.com,u1\n"
+    "C,D,,\"c@x.com,d@x.com\",u2\n"
+)
+
+
+def upload(client, **fields):
+    """POST SAMPLE_CSV to /upload with extra form fields."""
+    data = {'file': (io.BytesIO(SAMPLE_CSV.encode('utf-8')), 'sample.csv')}
+    data.update(fields)
+    return client.post('/upload', data=data, content_type='multipart/form-data')
+
+
+def preview(client, body, content_type='text/csv', **params):
+    """POST a raw body to /preview with query parameters."""
+    return client.post('/preview', data=body, content_type=content_type, query_string=params)
+
+
+def test_preview_multipart_field_before_file():
+    """Form fields ahead of the file part are skipped; the file part is previewed."""
+    response = web.app.test_client().post('/preview', data={
+        'note': 'not the file',
+        'file': (io.BytesIO(SAMPLE_CSV.encode('utf-8')), 'sample.csv')
+    }, content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert response.json['input_columns'][0] == 'FIRST_NAME'
+    assert response.json['rows_previewed'] == 2
+    assert response.json['preview'][0]['PRIMARY_PHONE'] == '5551234567'
+
+
+def test_preview_raw_csv_body():
+    """A raw text/csv body is previewed as the file itself."""
+    response = preview(web.app.test_client(), SAMPLE_CSV.replace(',', ';'), rows=1)
+    assert response.status_code == 200
+    assert response.json['delimiter'] == ';'
+    assert response.json['rows_previewed'] == 1
+    assert response.json['preview'][0]['PRIMARY_EMAIL'] == 'a@x.com'
+    assert 'LINKEDIN_URL' in response.json['missing_columns']
+
+
+def test_preview_partial_drops_cut_off_line():
+    """partial=true ignores a last line cut off mid-record."""
+    head = SAMPLE_CSV + "E,F,+1 555 999"
+    client = web.app.test_client()
+
+    response = preview(client, head, partial='true')
+    assert response.status_code == 200
+    assert response.json['rows_previewed'] == 2
+
+    response = preview(client, head)
+    assert response.json['rows_previewed'] == 3
+    assert response.json['preview'][2]['FIRST_NAME'] == 'E'
+
+
+def test_preview_cr_line_endings():
+    """CR-only line endings (Excel for Mac's "CSV (Macintosh)") preview like any other CSV."""
+    client = web.app.test_client()
+    for newline in ['\r', '\r\n']:
+        response = preview(client, SAMPLE_CSV.replace('\n', newline))
+        assert response.status_code == 200, newline
+        assert response.json['rows_previewed'] == 2
+        assert response.json['preview'][1]['UUID'] == 'u2'
+
+
+def test_preview_drops_rest_of_upload_under_gunicorn():
+    """Under gunicorn.conf.py the connection is closed after a preview, so a
+    streamed upload stops instead of the worker reading all of it."""
+    pytest.importorskip('gunicorn')
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+        cwd=Path(__file__).parent, env=dict(os.environ, PORT=str(port)),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        deadline = time.time() + 30
+        while not get_health(port):
+            assert server.poll() is None and time.time() < deadline, "gunicorn did not start"
+            time.sleep(0.05)
+
+        total = 200 * 1024 * 1024
+        sock = socket.create_connection(('127.0.0.1', port))
+        sock.sendall(f"POST /preview HTTP/1.1\r\nHost: localhost\r\nContent-Type: text/csv\r\n"
+                     f"Content-Length: {total}\r\n\r\n".encode('ascii'))
+        sent = [0]
+
+        def stream_body():
+            chunk = SAMPLE_CSV.encode('utf-8') + b"E,F,,e@x.com,u3\n" * 4000
+            try:
+                while sent[0] < total:
+                    sock.sendall(chunk)
+                    sent[0] += len(chunk)
+            except OSError:
+                pass
+
+        sender = threading.Thread(target=stream_body)
+        sender.start()
+        response = b''
+        while b'"success":true' not in response:
+            data = sock.recv(65536)
+            assert data, response
+            response += data
+        sender.join(30)
+        sock.close()
+
+        assert response.startswith(b'HTTP/1.1 200')
+        assert not sender.is_alive()
+        # The server hung up after the head; socket buffers hold a few MB at most
+        assert sent[0] < total // 4, f"{sent[0]:,} of {total:,} bytes sent"
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+def test_preview_rejects_bad_requests():
+    """An empty body or a non-numeric rows parameter is a 400."""
+    client = web.app.test_client()
+
+    response = preview(client, b'')
+    assert response.status_code == 400
+    assert not response.json['success']
+
+    response = preview(client, SAMPLE_CSV, rows='abc')
+    assert response.status_code == 400
+    assert response.json['error'] == 'rows must be a whole number'
+
+
+def test_deliver_callback_retries():
+    """A delivery that fails twice is retried and arrives on the third attempt."""
+    server, received = start_callback_receiver(fail_first=2)
+    try:
+        delivered = web.deliver_callback(
+            f"http://127.0.0.1:{server.server_port}/done", {'success': True, 'rows_processed': 2},
+            max_attempts=3, backoff_seconds=0, allowed_hosts=['127.0.0.1']
+        )
+        assert delivered
+        assert received.get(timeout=5) == {'success': True, 'rows_processed': 2}
+        assert received.empty()
+    finally:
+        server.shutdown()
+
+
+def test_deliver_callback_gives_up():
+    """Delivery stops after max_attempts failures."""
+    server, received = start_callback_receiver(fail_first=5)
+    try:
+        delivered = web.deliver_callback(
+            f"http://127.0.0.1:{server.server_port}/done", {'success': True},
+            max_attempts=2, backoff_seconds=0, allowed_hosts=['127.0.0.1']
+        )
+        assert not delivered
+        assert received.empty()
+    finally:
+        server.shutdown()
+
+
+def test_upload_with_callback():
+    """/upload with callback_url answers 202 and POSTs the result to the receiver."""
+    server, received = start_callback_receiver()
+    web.app.config['CALLBACK_ALLOWED_HOSTS'] = ['127.0.0.1']
+    try:
+        response = upload(web.app.test_client(),
+                          callback_url=f"http://127.0.0.1:{server.server_port}/done")
+        assert response.status_code == 202
+        assert response.json['status'] == 'accepted'
+
+        payload = received.get(timeout=10)
+        assert payload['success']
+        assert payload['file_id'] == response.json['file_id']
+        assert payload['rows_processed'] == 2
+        assert payload['preview'][0]['PRIMARY_PHONE'] == '5551234567'
+        assert payload['preview'][1]['PRIMARY_EMAIL'] == 'c@x.com'
+        assert set(payload['timings']) == {'save_seconds', 'processing_seconds', 'total_seconds'}
+    finally:
+        web.app.config['CALLBACK_ALLOWED_HOSTS'] = []
+        server.shutdown()
+
+
+def test_upload_rejects_internal_callback_urls():
+    """Callbacks to loopback, private or metadata addresses are refused."""
+    client = web.app.test_client()
+    for url in ['http://127.0.0.1:8080/hook', 'http://169.254.169.254/latest/meta-data',
+                'http://10.0.0.5/hook', 'http://[::1]/hook', 'ftp://example.com/hook']:
+        response = upload(client, callback_url=url)
+        assert response.status_code == 400, url
+        assert not response.json['success']
+
+
+def test_upload_callback_allowed_hosts():
+    """With CALLBACK_ALLOWED_HOSTS set, other hosts are refused."""
+    web.app.config['CALLBACK_ALLOWED_HOSTS'] = ['hooks.example.com']
+    try:
+        response = upload(web.app.test_client(), callback_url='https://other.example.com/hook')
+        assert response.status_code == 400
+        assert 'not allowed' in response.json['error']
+    finally:
+        web.app.config['CALLBACK_ALLOWED_HOSTS'] = []
+
+
+def test_job_pool_is_bounded():
+    """submit_job refuses work once running and queued slots are full."""
+    release = threading.Event()
+    started = queue.Queue()
+
+    def job():
+        started.put(True)
+        release.wait(10)
+
+    slots = web.app.config['CALLBACK_MAX_WORKERS'] + web.app.config['CALLBACK_MAX_QUEUED']
+    web.app.config['CALLBACK_ALLOWED_HOSTS'] = ['hooks.example.com']
+    try:
+        assert all(web.submit_job(job) for _ in range(slots))
+        assert not web.submit_job(job)
+
+        # /upload answers 503 instead of starting another job
+        response = upload(web.app.test_client(), callback_url='https://hooks.example.com/done')
+        assert response.status_code == 503
+    finally:
+        web.app.config['CALLBACK_ALLOWED_HOSTS'] = []
+        release.set()
+    started.get(timeout=5)
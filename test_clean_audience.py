@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Tests for the Audience Cleaner library functions
+Run with pytest; covers the reference join and the external sort
+"""
+
+import csv
+
+import pytest
+
+import clean_audience
+
+HEADER = clean_audience.INPUT_COLUMNS + ['LINKEDIN_URL']
+
+
+def cleaned_rows(count):
+    """Cleaned row tuples with mixed-case, blank and repeated emails."""
+    clean = clean_audience.make_row_cleaner(HEADER)
+    rows = []
+    for i in range(count):
+        if i % 7 == 0:
+            email = ''
+        elif i % 5 == 0:
+            email = f'User{i % 40}@Example.COM'
+        else:
+            email = f'user{i % 400}@example.com'
+        rows.append(clean([f'First{i}', f'Last{i % 13}', f'555{i:07d}', '', '', email, '',
+                           f'uuid-{i}', 'Austin', 'TX', '', '', '', '', '', '', '', '']))
+    return rows
+
+
+def write_reference(path, count):
+    """Reference CSV keyed on lower- and upper-case emails, with duplicates and blanks."""
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['email', 'ACCOUNT_ID', 'OWNER'])
+        for i in range(count):
+            key = f'USER{i % 300}@EXAMPLE.com' if i % 3 == 0 else f'user{i % 300}@example.com'
+            writer.writerow([key if i % 11 else '', f'acct-{i}', f'owner{i % 17}'])
+    return str(path)
+
+
+def test_join_paths_match(tmp_path):
+    """The hash join and the sort-merge join give identical output."""
+    reference = write_reference(tmp_path / 'reference.csv', 2000)
+    columns = clean_audience.get_reference_columns(reference, 'PRIMARY_EMAIL', 'email')
+    rows = cleaned_rows(3000)
+
+    hashed = list(clean_audience.enrich_rows(rows, clean_audience.OUTPUT_COLUMNS, reference,
+                                             'PRIMARY_EMAIL', 'email', columns))
+    merged = list(clean_audience.enrich_rows(rows, clean_audience.OUTPUT_COLUMNS, reference,
+                                             'PRIMARY_EMAIL', 'email', columns,
+                                             index_max_bytes=0, memory_budget=50 * 1024,
+                                             tmp_dir=tmp_path))
+
+    assert [tuple(row) for row in merged] == hashed
+    assert len(hashed) == len(rows)
+    by_email = {}
+    for row in hashed:
+        by_email.setdefault(row[clean_audience.OUTPUT_COLUMNS.index('PRIMARY_EMAIL')], row[-2:])
+    # First reference row wins (row 0 has a blank key, so user0 matches row 300),
+    # and keys match regardless of case on either side
+    assert by_email['User0@Example.COM'] == ('acct-300', 'owner11')
+    assert by_email['User5@Example.COM'] == ('acct-5', 'owner5')
+    assert by_email['user3@example.com'] == ('acct-3', 'owner3')
+    # Rows with a blank email never match, even though the reference has blank keys
+    assert by_email[''] == ('', '')
+
+
+def test_join_uses_estimated_index_size(tmp_path, monkeypatch):
+    """The disk join is chosen from the estimated index size, not the file size."""
+    reference = write_reference(tmp_path / 'reference.csv', 100)
+    columns = clean_audience.get_reference_columns(reference, 'PRIMARY_EMAIL', 'email')
+    estimated = clean_audience.estimate_index_bytes(reference)
+    assert estimated == (tmp_path / 'reference.csv').stat().st_size * clean_audience.REFERENCE_INDEX_MEMORY_FACTOR
+
+    def no_index(*args):
+        raise AssertionError("hash index built for a reference over the budget")
+
+    monkeypatch.setattr(clean_audience, 'load_reference_index', no_index)
+    rows = list(clean_audience.enrich_rows(cleaned_rows(10), clean_audience.OUTPUT_COLUMNS,
+                                           reference, 'PRIMARY_EMAIL', 'email', columns,
+                                           index_max_bytes=estimated - 1))
+    assert len(rows) == 10
+
+
+def test_reference_cache_is_bounded_by_bytes(tmp_path, monkeypatch):
+    """Cached indexes are evicted oldest first once their total size exceeds the limit."""
+    references = [write_reference(tmp_path / f'reference{i}.csv', 50 + i) for i in range(3)]
+    sizes = [clean_audience.estimate_index_bytes(path) for path in references]
+    monkeypatch.setattr(clean_audience, '_reference_index_cache', {})
+    monkeypatch.setattr(clean_audience, '_REFERENCE_INDEX_CACHE_BYTES', sizes[1] + sizes[2])
+
+    for path in references:
+        clean_audience.load_reference_index(path, 'PRIMARY_EMAIL', 'email', ['ACCOUNT_ID'])
+
+    cached = clean_audience._reference_index_cache
+    assert [size for _, size in cached.values()] == sizes[1:]
+    assert sum(size for _, size in cached.values()) <= clean_audience._REFERENCE_INDEX_CACHE_BYTES
+
+    # An index bigger than the whole cache is built but not kept
+    monkeypatch.setattr(clean_audience, '_REFERENCE_INDEX_CACHE_BYTES', sizes[0] - 1)
+    clean_audience._reference_index_cache.clear()
+    index = clean_audience.load_reference_index(references[0], 'PRIMARY_EMAIL', 'email', ['ACCOUNT_ID'])
+    assert index['user1@example.com'] == ('acct-1',)
+    assert not clean_audience._reference_index_cache
+
+
+def sort_records(count):
+    """String-list records with repeated, blank and unevenly sized sort keys."""
+    return [[f'k{(i * 7919) % 97}' if i % 9 else '', f'{i % 3}', f'row{i}', 'x' * (i % 50)]
+            for i in range(count)]
+
+
+def test_sort_rows_matches_sorted(tmp_path):
+    """sort_rows gives the same order as a stable sorted(), whatever the spill budget."""
+    records = sort_records(3000)
+    fieldnames = ['KEY', 'GROUP', 'ID', 'PAD']
+    expected = sorted(records, key=lambda r: [r[0], r[1]])
+    for budget in [1, 1024, 50 * 1024, clean_audience.SORT_MEMORY_BUDGET]:
+        result = clean_audience.sort_rows(iter(records), fieldnames, ['KEY', 'GROUP'],
+                                          memory_budget=budget, tmp_dir=tmp_path)
+        assert [list(r) for r in result] == expected, budget
+
+
+def test_sort_rows_dedupe_keeps_first_row(tmp_path):
+    """dedupe keeps the first row per key in input order and never drops blank keys."""
+    records = sort_records(3000)
+    fieldnames = ['KEY', 'GROUP', 'ID', 'PAD']
+    expected = []
+    seen = set()
+    for record in sorted(records, key=lambda r: r[0]):
+        if record[0] and record[0] in seen:
+            continue
+        seen.add(record[0])
+        expected.append(record)
+
+    result = [list(r) for r in clean_audience.sort_rows(iter(records), fieldnames, ['KEY'], dedupe=True,
+                                                        memory_budget=2048, tmp_dir=tmp_path)]
+    assert result == expected
+    assert sum(1 for r in result if not r[0]) == sum(1 for r in records if not r[0])
+    first = next(r for r in records if r[0] == 'k5')
+    assert next(r for r in result if r[0] == 'k5') == first
+
+
+def test_external_sort_limits_open_runs(tmp_path, monkeypatch):
+    """Runs are merged in passes so no more than max_runs temp files are open at once."""
+    open_runs = []
+    peak = [0]
+    real_temporary_file = clean_audience.tempfile.TemporaryFile
+
+    class TrackedRun:
+        def __init__(self, *args, **kwargs):
+            self._file = real_temporary_file(*args, **kwargs)
+            open_runs.append(self)
+            peak[0] = max(peak[0], len(open_runs))
+
+        def __getattr__(self, name):
+            return getattr(self._file, name)
+
+        def __iter__(self):
+            return iter(self._file)
+
+        def close(self):
+            if self in open_runs:
+                open_runs.remove(self)
+            self._file.close()
+
+    monkeypatch.setattr(clean_audience.tempfile, 'TemporaryFile', TrackedRun)
+    records = sort_records(500)
+    result = list(clean_audience.external_sort(iter(records), key=lambda r: r[0],
+                                               memory_budget=1, tmp_dir=tmp_path, max_runs=8))
+    assert result == sorted(records, key=lambda r: r[0])
+    # max_runs runs plus the merged run being written
+    assert peak[0] <= 9
+    assert not open_runs
+
+
+def test_external_sort_rejects_bad_budget():
+    """A zero or negative memory budget is an error, not one temp file per row."""
+    for budget in [0, -5 * 1024 * 1024]:
+        with pytest.raises(ValueError):
+            list(clean_audience.external_sort(iter([['a'], ['b']]), key=lambda r: r[0],
+                                              memory_budget=budget))
+
+
+def reference_clean(row):
+    """Clean a csv.DictReader row with the reference functions, as csv.DictWriter wrote it."""
+    primary_phone = clean_audience.get_primary_phone(row)
+    primary_email = clean_audience.get_primary_email(row)
+    linkedin_url = next((row.get(c) for c in clean_audience.LINKEDIN_COLUMNS if row.get(c)), '')
+    values = {
+        'PRIMARY_PHONE': primary_phone,
+        'PRIMARY_EMAIL': primary_email,
+        'Personal_Phone': clean_audience.clean_phone(row.get('PERSONAL_PHONE', '')),
+        'Mobile_Phone': clean_audience.clean_phone(row.get('MOBILE_PHONE', '')),
+        'Valid_Phone': primary_phone,
+        'NET_WORTH': clean_audience.clean_income_range(row.get('NET_WORTH', '')),
+        'INCOME_RANGE': clean_audience.clean_income_range(row.get('INCOME_RANGE', '')),
+        'LINKEDIN_URL': linkedin_url.strip(),
+        'SHA256': clean_audience.generate_sha256(row, primary_email, primary_phone)
+    }
+    return tuple(values[c] if c in values else row.get(c) or ''
+                 for c in clean_audience.OUTPUT_COLUMNS)
+
+
+def test_row_cleaner_matches_reference_functions():
+    """make_row_cleaner agrees with the reference functions on short rows and missing columns."""
+    full = (clean_audience.INPUT_COLUMNS + ['LINKEDIN_URL'],
+            ['Ann', 'Lee', '', '+1 (555) 222-3333', '555.444.5555', ' ',
+             'x, ann@example.com', 'u-1', 'Austin', 'TX', '25-34', 'Y', 'F', 'Y', 'N',
+             '$100,000 - $249,999', '$50,000 - $74,999', ' linkedin.com/in/ann '])
+    # No PERSONAL_PHONE or BUSINESS_EMAIL column, and a different LinkedIn header
+    partial = ([c for c in clean_audience.INPUT_COLUMNS if c not in ('PERSONAL_PHONE', 'BUSINESS_EMAIL')]
+               + ['LinkedIn'],
+               ['Bob', 'Ray', '15553334444', '', 'bob@example.com;b2@example.com', 'u-2', 'Reno',
+                'NV', '', '', 'M', '', '', '', '$1,000', 'linkedin.com/in/bob'])
+
+    for header, fields in [full, partial]:
+        # Rows cut short at every column, the whole row, and a row with an extra value
+        rows = [fields[:width] for width in range(1, len(fields) + 1)] + [fields + ['extra']]
+        lines = [','.join(f'"{v}"' for v in row) for row in [header] + rows]
+        expected = [reference_clean(row) for row in csv.DictReader(lines)]
+        reader = csv.reader(lines)
+        clean = clean_audience.make_row_cleaner(next(reader))
+        assert [clean(row) for row in reader] == expected
+
+
+def test_iter_lines_universal_newlines():
+    """iter_lines translates \r\n and \r like universal-newlines mode, even across chunks."""
+    chunks = [b'a,b\r', b'\n1,2\r3,4\r\n', b'5,', b'6\r', b'7,8']
+    assert list(clean_audience.iter_lines(chunks)) == ['a,b\n', '1,2\n', '3,4\n', '5,6\n', '7,8']
+    assert list(clean_audience.iter_lines(chunks, drop_partial=True)) == ['a,b\n', '1,2\n', '3,4\n', '5,6\n']
+    assert list(clean_audience.iter_lines([b'x\r'])) == ['x\n']
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Memory budget tests for the Audience Cleaner hot loop
+Checks per-row allocations and peak RSS on a large synthetic file, plain,
+sorted and joined against a reference on disk
+"""
+
+import atexit
+import csv
+import itertools
+import os
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+import clean_audience
+
+# Rows in the synthetic file for the peak-RSS tests (override with TEST_MEMORY_ROWS)
+RSS_TEST_ROWS = int(os.environ.get('TEST_MEMORY_ROWS', 1000000))
+
+# Memory still held after the loop, per row processed (nothing may accumulate)
+RETAINED_BYTES_PER_ROW = 1
+
+# Peak traced memory above the starting point while streaming rows - the
+# handful of rows in flight, independent of how many rows are processed
+ROW_ALLOCATION_BUDGET = 128 * 1024
+
+# Peak RSS of a whole process cleaning RSS_TEST_ROWS rows
+PEAK_RSS_CEILING = 64 * 1024 * 1024
+
+# Peak RSS when also sorting with SORT_TEST_MEMORY as the sort memory budget
+SORT_TEST_MEMORY = 8 * 1024 * 1024
+SORT_PEAK_RSS_CEILING = 96 * 1024 * 1024
+
+# Extra peak RSS of an on-disk reference join (optionally also sorted) over
+# plain cleaning, with SORT_TEST_MEMORY as the budget - the concurrent sorts
+# share one budget instead of each taking all of it (measured about 1.5x the
+# budget at 1M rows; 3x when each sort got the whole budget)
+JOIN_EXTRA_RSS_CEILING = 2 * SORT_TEST_MEMORY
+
+_synthetic_files = {}
+
+
+def synthetic_file(rows, extra_columns):
+    """Write (once) a synthetic Audience Lab CSV and return its path."""
+    key = (rows, extra_columns)
+    if key in _synthetic_files:
+        return _synthetic_files[key]
+
+    header = clean_audience.INPUT_COLUMNS + ['LINKEDIN_URL'] + [f'EXTRA_{i}' for i in range(extra_columns)]
+    fd, path = tempfile.mkstemp(suffix='.csv', prefix='memtest_')
+    with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        extras = ['value'] * extra_columns
+        for i in range(rows):
+            writer.writerow([
+                f'First{i % 997}', f'Last{i % 991}', f'+1 (555) {i % 1000:03d}-{i % 10000:04d}',
+                '5553334444, 5551112222', '', f'user{i}@example.com', 'a@example.com,b@example.com',
+                f'uuid-{i}', 'Austin', ['TX', 'CA', 'NY'][i % 3], '25-34', 'Y', 'F', 'Y', 'N',
+                '$100,000 - $249,999', '$50,000 - $74,999', f'linkedin.com/in/user{i}'
+            ] + extras)
+
+    _synthetic_files[key] = path
+    atexit.register(lambda: os.path.exists(path) and os.remove(path))
+    return path
+
+
+def synthetic_reference(rows):
+    """Write (once) a reference CSV matching every other synthetic row by email."""
+    key = ('reference', rows)
+    if key in _synthetic_files:
+        return _synthetic_files[key]
+
+    fd, path = tempfile.mkstemp(suffix='.csv', prefix='memtest_ref_')
+    with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['PRIMARY_EMAIL', 'ACCOUNT_ID', 'OWNER'])
+        for i in range(0, rows, 2):
+            writer.writerow([f'user{i}@example.com', f'acct-{i}', f'owner{i % 50}'])
+
+    _synthetic_files[key] = path
+    atexit.register(lambda: os.path.exists(path) and os.remove(path))
+    return path
+
+
+def peak_rss(input_file, **options):
+    """Run process_csv in a fresh interpreter and return its peak RSS in bytes."""
+    output_file = input_file + '.out'
+    code = (
+        "import contextlib, os, resource, sys\n"
+        "import clean_audience\n"
+        "with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):\n"
+        f"    clean_audience.process_csv({input_file!r}, {output_file!r}, **{options!r})\n"
+        "try:\n"
+        "    # VmHWM starts over at exec; on Linux ru_maxrss keeps the parent's RSS from fork\n"
+        "    with open('/proc/self/status') as status:\n"
+        "        print(next(int(line.split()[1]) * 1024 for line in status if line.startswith('VmHWM:')))\n"
+        "except OSError:\n"
+        "    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss\n"
+        "    # ru_maxrss is in kilobytes on Linux and bytes on macOS\n"
+        "    print(max_rss if sys.platform == 'darwin' else max_rss * 1024)\n"
+    )
+    try:
+        result = subprocess.run([sys.executable, '-c', code], cwd=Path(__file__).parent,
+                                capture_output=True, text=True, check=True)
+    finally:
+        if os.path.exists(output_file):
+            os.remove(output_file)
+    return int(result.stdout.split()[-1])
+
+
+def test_row_allocation_budget(rows=20000):
+    """Streaming rows through the hot loop keeps allocations per row bounded."""
+    input_file = synthetic_file(rows, extra_columns=300)
+
+    with open(input_file, 'r', encoding='utf-8', errors='replace') as infile, \
+         open(os.devnull, 'w', newline='') as outfile:
+        writer = csv.writer(outfile)
+        cleaned = clean_audience.read_cleaned_rows(infile)
+        # Warm up caches (regex, hashlib, file buffers) before measuring
+        writer.writerows(itertools.islice(cleaned, 100))
+
+        tracemalloc.start()
+        try:
+            before, _ = tracemalloc.get_traced_memory()
+            processed = 0
+            for row in cleaned:
+                writer.writerow(row)
+                processed += 1
+            after, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    retained = (after - before) / processed
+    in_flight = peak - before
+    print(f"   {processed:,} rows: {retained:.2f} bytes retained per row, "
+          f"{in_flight / 1024:.1f}KB peak in flight")
+    assert retained < RETAINED_BYTES_PER_ROW, f"{retained:.2f} bytes retained per row"
+    assert in_flight < ROW_ALLOCATION_BUDGET, f"{in_flight:,} bytes in flight"
+
+
+def test_output_rows_are_compact():
+    """Cleaned rows are tuples in OUTPUT_COLUMNS order, not per-row dicts."""
+    header = clean_audience.INPUT_COLUMNS + ['LINKEDIN_URL']
+    clean = clean_audience.make_row_cleaner(header)
+    row = clean(['x'] * len(header))
+    assert isinstance(row, tuple)
+    assert len(row) == len(clean_audience.OUTPUT_COLUMNS)
+    assert sys.getsizeof(row) < sys.getsizeof(dict(zip(clean_audience.OUTPUT_COLUMNS, row)))
+
+
+def test_peak_rss():
+    """Cleaning a large file stays under the peak-RSS ceiling."""
+    rss = peak_rss(synthetic_file(RSS_TEST_ROWS, extra_columns=12))
+    print(f"   {RSS_TEST_ROWS:,} rows: peak RSS {rss / 1024 / 1024:.1f}MB "
+          f"(ceiling {PEAK_RSS_CEILING / 1024 / 1024:.0f}MB)")
+    assert rss < PEAK_RSS_CEILING, f"peak RSS {rss:,} bytes"
+
+
+def test_sorted_peak_rss():
+    """Sorting a large file spills to disk instead of growing with the row count."""
+    rss = peak_rss(synthetic_file(RSS_TEST_ROWS, extra_columns=12),
+                   sort_by='SHA256', sort_memory=SORT_TEST_MEMORY)
+    print(f"   {RSS_TEST_ROWS:,} rows sorted: peak RSS {rss / 1024 / 1024:.1f}MB "
+          f"(ceiling {SORT_PEAK_RSS_CEILING / 1024 / 1024:.0f}MB)")
+    assert rss < SORT_PEAK_RSS_CEILING, f"peak RSS {rss:,} bytes"
+
+
+def test_joined_peak_rss():
+    """An on-disk reference join stays within the sort memory budget, with or without sorting."""
+    input_file = synthetic_file(RSS_TEST_ROWS, extra_columns=12)
+    baseline = peak_rss(input_file)
+    for options in [{}, {'sort_by': 'SHA256'}]:
+        # reference_memory=0 forces the sort-merge join
+        rss = peak_rss(input_file, reference_file=synthetic_reference(RSS_TEST_ROWS),
+                       reference_memory=0, sort_memory=SORT_TEST_MEMORY, **options)
+        extra = rss - baseline
+        print(f"   {RSS_TEST_ROWS:,} rows joined {options}: peak RSS {rss / 1024 / 1024:.1f}MB, "
+              f"{extra / 1024 / 1024:.1f}MB over cleaning "
+              f"(ceiling {JOIN_EXTRA_RSS_CEILING / 1024 / 1024:.0f}MB)")
+        assert extra < JOIN_EXTRA_RSS_CEILING, f"join used {extra:,} bytes over cleaning"
+
+
+if __name__ == '__main__':
+    print("🧪 Testing Audience Cleaner memory budgets")
+    print("=" * 50)
+
+    tests = [test_row_allocation_budget, test_output_rows_are_compact,
+             test_peak_rss, test_sorted_peak_rss, test_joined_peak_rss]
+    failed = 0
+    for number, test in enumerate(tests, 1):
+        print(f"\n{number}. {test.__doc__}")
+        try:
+            test()
+            print("✅ Passed")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ Failed: {e}")
+
+    sys.exit(1 if failed else 0)